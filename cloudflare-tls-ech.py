@@ -1,191 +1,403 @@
+import argparse
 import asyncio
+import aiofiles
 import aiohttp
+import logging
+import orjson
 import os
+import random
+import sys
 from datetime import datetime
-from typing import List, Dict, Optional
+from aiolimiter import AsyncLimiter
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import List, Dict, NamedTuple, Optional, Tuple
+
+if sys.platform != "win32":
+    import uvloop
+
+# Максимум, который принимает GET /zones: большие значения API отклоняет с ошибкой 400
+ZONES_PER_PAGE = 50
+
+# Глобальный лимит Cloudflare API: 1200 запросов за 5 минут. Лимитер пропускает
+# ту же среднюю скорость (4 запроса в секунду) без начального всплеска
+RATE_LIMIT_REQUESTS = 1200
+RATE_LIMIT_PERIOD = 300
+
+# Сколько раз пробуем обновить зону при 429, 5xx и сетевых ошибках
+MAX_ATTEMPTS = 5
+
+# Сколько страниц списка зон загружается одновременно при потоковой обработке
+PAGE_FETCH_CONCURRENCY = 4
+
+# Результаты по зонам копятся и пишутся в файл одной операцией, когда набралась
+# пачка или прошло RESULTS_FLUSH_INTERVAL секунд с первого результата в пачке
+RESULTS_BATCH_SIZE = 500
+RESULTS_FLUSH_INTERVAL = 1.0
+
+# Действия командной строки: тип настройки и значение
+ACTIONS = {
+    "tls-on": ("tls", "enable"),
+    "tls-off": ("tls", "disable"),
+    "ech-on": ("ech", "enable"),
+    "ech-off": ("ech", "disable"),
+}
+
+# От объекта зоны нужны только id и имя; остальные поля не храним
+class Zone(NamedTuple):
+    id: str
+    name: str
+
+# Строки статуса по доменам выводит фоновый поток (QueueListener), чтобы запись
+# в stdout не блокировала цикл событий на каждом домене
+_log_queue = SimpleQueue()
+log = logging.getLogger("cloudflare")
+log.addHandler(QueueHandler(_log_queue))
+log.setLevel(logging.INFO)
+log.propagate = False
 
 class CloudflareManager:
-    def __init__(self, api_token: str, action_type: str, action_value: str):
+    def __init__(self, api_token: str, action_type: str, action_value: str, max_connections: int = 32,
+                 results_path: str = "results.jsonl"):
         self.api_token = api_token
-        self.action_type = action_type  # 'tls' или 'ech'
-        self.action_value = action_value  # 'enable' или 'disable'
-        self.base_url = "https://api.cloudflare.com/client/v4/zones"
+        self.base_url = "/client/v4/zones"
+        self.set_action(action_type, action_value)
         self.headers = {
             "Authorization": f"Bearer {api_token}",
             "Content-Type": "application/json"
         }
-        self.domains = []
-        self.results = []
+        # Итоги считаются по ходу работы, без хранения результата по каждой зоне
+        self.successful = 0
+        self.failed = 0
+        # Результат по каждой зоне сразу уходит в файл (по строке JSON на зону)
+        self.results_path = results_path
+        self.max_connections = max_connections
+        # Общий для всех запросов к API: и чтения страниц, и PATCH
+        self._limiter = AsyncLimiter(RATE_LIMIT_REQUESTS / RATE_LIMIT_PERIOD, 1)
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    def set_action(self, action_type: str, action_value: str):
+        self.action_type = action_type  # 'tls' или 'ech'
+        self.action_value = action_value  # 'enable' или 'disable'
 
-    async def fetch_page(self, session: aiohttp.ClientSession, page: int, per_page: int = 50) -> Optional[Dict]:
+        # Всё, что зависит только от действия, вычисляется один раз, а не для каждого домена
+        setting = "tls_1_3" if action_type == 'tls' else "ech"
+        self._path_tmpl = f"{self.base_url}/{{}}/settings/{setting}"
+        self._body_bytes = orjson.dumps({"value": "on" if action_value == "enable" else "off"})
+        self._feature_name = "TLS 1.3" if action_type == 'tls' else "ECH"
+        action_text = "включен" if action_value == "enable" else "отключен"
+        self._ok_suffix = f": {self._feature_name} {action_text}"
+        self._err_suffix = ": Ошибка"
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            # Все запросы идут на один хост; соединений столько же, сколько обработчиков
+            limit=self.max_connections,
+            limit_per_host=self.max_connections,
+            # aiodns не блокирует цикл событий на getaddrinfo()
+            resolver=aiohttp.AsyncResolver(),
+            use_dns_cache=True,
+            ttl_dns_cache=600,
+            keepalive_timeout=75,
+            enable_cleanup_closed=True,
+        )
+        # httpx с HTTP/2 на этой нагрузке оказался медленнее, поэтому HTTP/1.1 с keep-alive
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            base_url="https://api.cloudflare.com",
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    async def fetch_page(self, page: int, per_page: int = ZONES_PER_PAGE) -> Optional[Dict]:
         try:
             url = f"{self.base_url}?page={page}&per_page={per_page}"
-            async with session.get(url, headers=self.headers) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    print(f"Ошибка получения страницы {page}: {response.status}")
-                    return None
+            async with self._limiter:
+                async with self.session.get(url) as response:
+                    if response.status == 200:
+                        data = await response.json(loads=orjson.loads)
+                        if data.get('success'):
+                            data['result'] = [Zone(zone['id'], zone['name']) for zone in data['result']]
+                        return data
+                    else:
+                        print(f"Ошибка получения страницы {page}: {response.status}")
+                        return None
         except Exception as e:
             print(f"Ошибка при получении страницы {page}: {str(e)}")
             return None
 
-    async def update_setting_for_domain(self, session: aiohttp.ClientSession, domain: Dict) -> Dict:
-        domain_id = domain['id']
-        domain_name = domain['name']
-        
-        # Определяем URL и значение в зависимости от типа действия
-        if self.action_type == 'tls':
-            url = f"{self.base_url}/{domain_id}/settings/tls_1_3"
-            setting_value = "on" if self.action_value == "enable" else "off"
-            feature_name = "TLS 1.3"
-        else:  # ech
-            url = f"{self.base_url}/{domain_id}/settings/ech"
-            setting_value = "on" if self.action_value == "enable" else "off"
-            feature_name = "ECH"
+    @staticmethod
+    def _retry_delay(retry_after: Optional[str], attempt: int) -> float:
+        # Cloudflare передаёт Retry-After в секундах; без него — экспоненциальная задержка со случайной добавкой
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return 2 ** attempt + random.random()
+
+    async def update_setting_for_domain(self, zone_id: str, zone_name: str) -> Dict:
+        # Один PATCH на зону: пакетного эндпоинта для нескольких зон в API нет,
+        # а предварительный GET текущего значения запросов не экономит
+        url = self._path_tmpl.format(zone_id)
+        success = False
         
-        action_text = "включен" if self.action_value == "enable" else "отключен"
+        for attempt in range(MAX_ATTEMPTS):
+            status = 0
+            error = None
+            retry_after = None
+            try:
+                async with self._limiter:
+                    async with self.session.patch(url, data=self._body_bytes) as response:
+                        status = response.status
+                        if status != 429 and status < 500:
+                            result = await response.json(loads=orjson.loads)
+                            success = status == 200 and result.get('success', False)
+                            break
+                        retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            except Exception as e:
+                error = e
+                break
+
+            if attempt < MAX_ATTEMPTS - 1:
+                await asyncio.sleep(self._retry_delay(retry_after, attempt))
+
+        if error is not None:
+            log.info(f"✗ {zone_name}: Ошибка - {str(error)}")
+        else:
+            log.info(("✓ " if success else "✗ ") + zone_name + (self._ok_suffix if success else self._err_suffix))
+
+        if success:
+            self.successful += 1
+        else:
+            self.failed += 1
+
+        return {
+            'domain_id': zone_id,
+            'domain_name': zone_name,
+            'success': success,
+            'status_code': status,
+        }
+
+    async def list_domains(self) -> List[Zone]:
+        initial_data = await self.fetch_page(1)
+        if not initial_data or not initial_data.get('success'):
+            raise Exception("Ошибка получения данных")
+
+        total_pages = initial_data['result_info']['total_pages']
+        total_domains = initial_data['result_info']['total_count']
+        domains = initial_data['result']
+
+        if total_pages > 1:
+            tasks = [
+                self.fetch_page(page) 
+                for page in range(2, total_pages + 1)
+            ]
+            results = await asyncio.gather(*tasks)
+
+            for result in results:
+                if result and result.get('success'):
+                    domains.extend(result['result'])
         
-        try:
-            async with session.patch(url, headers=self.headers, json={"value": setting_value}) as response:
-                result = await response.json()
-                status = response.status
-                
-                success = status == 200 and result.get('success', False)
-                result_data = {
-                    'domain_id': domain_id,
-                    'domain_name': domain_name,
-                    'success': success,
-                    'status_code': status,
-                }
-                
-                status_mark = "✓" if success else "✗"
-                print(f"{status_mark} {domain_name}: {feature_name + ' ' + action_text if success else 'Ошибка'}")
-                
-                return result_data
-        except Exception as e:
-            print(f"✗ {domain_name}: Ошибка - {str(e)}")
-            return {
-                'domain_id': domain_id,
-                'domain_name': domain_name,
-                'success': False,
-                'status_code': 0,
-            }
-
-    async def list_domains(self):
-        async with aiohttp.ClientSession() as session:
-            initial_data = await self.fetch_page(session, 1)
-            if not initial_data or not initial_data.get('success'):
-                raise Exception("Ошибка получения данных")
+        print("\nСписок доменов в аккаунте:")
+        print("-" * 50)
+        for domain in domains:
+            print(f"{domain.name}")
+        print("-" * 50)
+        print(f"Всего доменов: {total_domains}\n")
 
-            total_pages = initial_data['result_info']['total_pages']
-            total_domains = initial_data['result_info']['total_count']
-            domains = initial_data['result']
+        return domains
 
-            if total_pages > 1:
-                tasks = [
-                    self.fetch_page(session, page) 
-                    for page in range(2, total_pages + 1)
-                ]
-                results = await asyncio.gather(*tasks)
+    async def _produce_domains(self, queue: asyncio.Queue, workers: int, zones: Optional[List[Zone]]):
+        action_text = "включения" if self.action_value == "enable" else "отключения"
 
-                for result in results:
-                    if result and result.get('success'):
-                        domains.extend(result['result'])
-            
-            print("\nСписок доменов в аккаунте:")
-            print("-" * 50)
-            for domain in domains:
-                print(f"{domain['name']}")
-            print("-" * 50)
-            print(f"Всего доменов: {total_domains}\n")
-
-            return domains
-
-    async def process_all_domains(self) -> List[Dict]:
-        async with aiohttp.ClientSession() as session:
-            initial_data = await self.fetch_page(session, 1)
+        # Список зон уже загружен (например, для показа пользователю) — повторно не запрашиваем
+        if zones is not None:
+            print(f"\nНачинаем процесс {action_text} {self._feature_name} для {len(zones)} доменов...")
+            for zone in zones:
+                await queue.put(zone)
+        else:
+            initial_data = await self.fetch_page(1)
             if not initial_data or not initial_data.get('success'):
                 raise Exception("Ошибка получения данных")
 
             total_pages = initial_data['result_info']['total_pages']
             total_domains = initial_data['result_info']['total_count']
             print(f"Найдено {total_domains} доменов на {total_pages} страницах")
+            print(f"\nНачинаем процесс {action_text} {self._feature_name} для {total_domains} доменов...")
+
+            for zone in initial_data['result']:
+                await queue.put(zone)
 
-            self.domains.extend(initial_data['result'])
+            # Одновременно загружается не больше PAGE_FETCH_CONCURRENCY страниц; каждая
+            # отдаётся обработчикам по мере загрузки, не дожидаясь самой медленной
+            pages = iter(range(2, total_pages + 1))
+            pending = set()
+            try:
+                while True:
+                    for page in pages:
+                        pending.add(asyncio.create_task(self.fetch_page(page)))
+                        if len(pending) >= PAGE_FETCH_CONCURRENCY:
+                            break
+                    if not pending:
+                        break
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        result = task.result()
+                        if result and result.get('success'):
+                            for zone in result['result']:
+                                await queue.put(zone)
+            finally:
+                for task in pending:
+                    task.cancel()
 
-            if total_pages > 1:
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def _consume_domains(self, queue: asyncio.Queue, results: asyncio.Queue):
+        while True:
+            zone = await queue.get()
+            if zone is None:
+                break
+            await results.put(await self.update_setting_for_domain(zone.id, zone.name))
+
+    async def _update_domains(self, queue: asyncio.Queue, results: asyncio.Queue):
+        await asyncio.gather(*(
+            self._consume_domains(queue, results)
+            for _ in range(self.max_connections)
+        ))
+        await results.put(None)
+
+    async def _write_results(self, f, results: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        batch = []
+        flush_at = None
+        done = False
+        while not done:
+            timeout = None if flush_at is None else max(flush_at - loop.time(), 0)
+            try:
+                result = await asyncio.wait_for(results.get(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                if result is None:
+                    done = True
+                else:
+                    batch.append(result)
+                    if flush_at is None:
+                        flush_at = loop.time() + RESULTS_FLUSH_INTERVAL
+
+            if batch and (done or len(batch) >= RESULTS_BATCH_SIZE or loop.time() >= flush_at):
+                await f.write(b"".join(orjson.dumps(r) + b"\n" for r in batch))
+                batch = []
+                flush_at = None
+
+    async def process_all_domains(self, zones: Optional[List[Zone]] = None) -> Tuple[int, int]:
+        listener = QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+        listener.start()
+        try:
+            # Файл открывается до первого PATCH: если писать некуда, зоны не меняются
+            async with aiofiles.open(self.results_path, "wb") as f:
+                # Очередь держит не больше двух зон на обработчик, а страниц в работе не больше
+                # PAGE_FETCH_CONCURRENCY, поэтому при потоковой загрузке память не растёт
+                # с числом зон. В интерактивном режиме весь список уже загружен для показа
+                queue = asyncio.Queue(maxsize=2 * self.max_connections)
+                results = asyncio.Queue(maxsize=2 * RESULTS_BATCH_SIZE)
                 tasks = [
-                    self.fetch_page(session, page) 
-                    for page in range(2, total_pages + 1)
+                    asyncio.create_task(self._write_results(f, results)),
+                    # Поставщик кладёт зоны в очередь по мере загрузки страниц, обработчики сразу их обновляют
+                    asyncio.create_task(self._produce_domains(queue, self.max_connections, zones)),
+                    asyncio.create_task(self._update_domains(queue, results)),
                 ]
-                results = await asyncio.gather(*tasks)
-
-                for result in results:
-                    if result and result.get('success'):
-                        self.domains.extend(result['result'])
+                # Если одна задача упала (например, запись в файл), остальные отменяются —
+                # иначе обработчики навсегда зависли бы на заполненной очереди
+                try:
+                    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                for task in done:
+                    task.result()
+        finally:
+            # Дописываем оставшиеся строки до того, как вызывающий код напечатает итоги
+            listener.stop()
 
-            feature_name = "TLS 1.3" if self.action_type == 'tls' else "ECH"
-            action_text = "включения" if self.action_value == "enable" else "отключения"
-            print(f"\nНачинаем процесс {action_text} {feature_name} для {len(self.domains)} доменов...")
-            
-            tasks = [
-                self.update_setting_for_domain(session, domain)
-                for domain in self.domains
-            ]
-            self.results = await asyncio.gather(*tasks)
+        return self.successful, self.failed
 
-        return self.results
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Массовое управление TLS 1.3 и ECH для всех доменов в аккаунте Cloudflare"
+    )
+    parser.add_argument(
+        "--action",
+        choices=ACTIONS,
+        help="действие для всех доменов; без параметра скрипт покажет список доменов и спросит действие",
+    )
+    return parser.parse_args(argv)
 
-async def main():
+async def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
     api_token = "ВСТАВИТЬ КЛЮЧ API"
 
-    temp_manager = CloudflareManager(api_token, "tls", "enable")
-    await temp_manager.list_domains()
+    manager = CloudflareManager(api_token, *ACTIONS[args.action or "tls-on"])
+    zones = None
 
-    while True:
-        print("\nВыберите действие:")
-        print("1. Включить TLS 1.3 для всех доменов")
-        print("2. Отключить TLS 1.3 для всех доменов")
-        print("3. Включить ECH для всех доменов")
-        print("4. Отключить ECH для всех доменов")
-        choice = input("Введите номер (1-4): ").strip()
-        
-        if choice in ['1', '2', '3', '4']:
-            break
-        print("Неверный выбор. Пожалуйста, введите число от 1 до 4.")
-
-    # Определяем тип действия и значение на основе выбора
-    if choice in ['1', '2']:
-        action_type = 'tls'
-        action_value = "enable" if choice == "1" else "disable"
-    else:
-        action_type = 'ech'
-        action_value = "enable" if choice == "3" else "disable"
-    
-    manager = CloudflareManager(api_token, action_type, action_value)
-    
-    feature_name = "TLS 1.3" if action_type == 'tls' else "ECH"
-    action_text = "включения" if action_value == "enable" else "отключения"
-    print(f"\nНачинаем процесс {action_text} {feature_name}...")
-    start_time = datetime.now()
-    
-    try:
-        results = await manager.process_all_domains()
+    async with manager:
+        if not args.action:
+            zones = await manager.list_domains()
+
+            while True:
+                print("\nВыберите действие:")
+                print("1. Включить TLS 1.3 для всех доменов")
+                print("2. Отключить TLS 1.3 для всех доменов")
+                print("3. Включить ECH для всех доменов")
+                print("4. Отключить ECH для всех доменов")
+                choice = input("Введите номер (1-4): ").strip()
+                
+                if choice in ['1', '2', '3', '4']:
+                    break
+                print("Неверный выбор. Пожалуйста, введите число от 1 до 4.")
+
+            # Определяем тип действия и значение на основе выбора
+            action = ["tls-on", "tls-off", "ech-on", "ech-off"][int(choice) - 1]
+            manager.set_action(*ACTIONS[action])
         
-        successful = sum(1 for r in results if r['success'])
-        failed = len(results) - successful
-        print(f"\nИтоги:")
-        print(f"Всего обработано доменов: {len(results)}")
-        print(f"Успешно: {successful}")
-        print(f"С ошибками: {failed}")
+        feature_name = "TLS 1.3" if manager.action_type == 'tls' else "ECH"
+        action_text = "включения" if manager.action_value == "enable" else "отключения"
+        print(f"\nНачинаем процесс {action_text} {feature_name}...")
+        start_time = datetime.now()
         
-    except Exception as e:
-        print(f"Ошибка: {str(e)}")
+        try:
+            successful, failed = await manager.process_all_domains(zones)
+            
+            print(f"\nИтоги:")
+            print(f"Всего обработано доменов: {successful + failed}")
+            print(f"Успешно: {successful}")
+            print(f"С ошибками: {failed}")
+            
+        except Exception as e:
+            print(f"Ошибка: {str(e)}")
     
     duration = datetime.now() - start_time
     print(f"\nВремя выполнения: {duration.total_seconds():.2f} секунд")
-    input("\nНажмите Enter для завершения...")
+    if not args.action:
+        input("\nНажмите Enter для завершения...")
+
+def run(argv: Optional[List[str]] = None):
+    if sys.platform == "win32":
+        # aiodns не работает с ProactorEventLoop, который используется в Windows по умолчанию
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        asyncio.run(main(argv), debug=False)
+    else:
+        # Цикл событий на libuv быстрее обрабатывает тысячи мелких колбэков ввода-вывода
+        uvloop.run(main(argv), debug=False)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    run()
\ No newline at end of file